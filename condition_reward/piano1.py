@@ -12,6 +12,9 @@ MAX_RUNTIME_MIN = 30
 MAX_REWARD_COUNT = 300
 TRIAL_TIMEOUT = 10.0
 LICK_DEBOUNCE_MS = 10
+RECONNECT_BACKOFF_MIN = 0.5   # seconds, first retry after a USB drop
+RECONNECT_BACKOFF_MAX = 10.0  # seconds, retry interval cap
+LISTENER_ERROR_PAUSE = 1.0    # seconds between retries after an unexpected listener error
 
 # ==== LOG FILES ====
 timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -26,6 +29,9 @@ lick_count_in_trial = 0
 last_lick_time = 0
 trial_num = 1  # ✅ global trial number
 lock = threading.Lock()
+ser = None
+link_up = threading.Event()
+link_epoch = 0  # bumped on every disconnect
 
 def open_serial(port, baudrate):
     try:
@@ -37,10 +43,39 @@ def open_serial(port, baudrate):
         print(f"[✗] Serial error: {e}")
         exit(1)
 
-def send_trial(ser):
+def send_trial():
     ser.write(b'1')
 
-def lick_listener(ser):
+def reconnect_serial(err):
+    global ser, link_epoch, trial_active
+    link_up.clear()
+    with lock:
+        link_epoch += 1
+        trial_active = False
+    lick_log.append(["LINK_LOST"])
+    print(f"[🔌] Serial link lost: {err}")
+    try:
+        ser.close()
+    except Exception:
+        pass
+
+    delay = RECONNECT_BACKOFF_MIN
+    while True:
+        time.sleep(delay)
+        try:
+            new_ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
+            time.sleep(2)
+            break
+        except (serial.SerialException, OSError) as e:
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+            print(f"[↻] Reconnect failed ({e}), retrying in {delay:.1f}s")
+
+    ser = new_ser
+    lick_log.append(["LINK_RESTORED"])
+    print(f"[✓] Serial reconnected on {SERIAL_PORT}")
+    link_up.set()
+
+def lick_listener():
     global trial_active, lick_count_in_trial, last_lick_time, trial_num
     buffer = b""
     while True:
@@ -75,10 +110,15 @@ def lick_listener(ser):
 
                     buffer = lines[-1]
             time.sleep(0.001)
+        except (serial.SerialException, OSError) as e:
+            # POSIX unplug surfaces as a bare OSError from in_waiting
+            reconnect_serial(e)
+            buffer = b""
         except Exception as e:
             print(f"[⚠️] Listener error: {e}")
+            time.sleep(LISTENER_ERROR_PAUSE)
 
-def log_trial(writer, trial_num, result_string, elapsed_ms, reward_count, lick_count):
+def log_trial(writer, trial_num, result_string, elapsed_ms, reward_count, lick_count, link_status="OK"):
     try:
         tone_type, reward_status, _ = result_string.split(",")
     except Exception as e:
@@ -86,12 +126,13 @@ def log_trial(writer, trial_num, result_string, elapsed_ms, reward_count, lick_c
         tone_type, reward_status = "Unknown", "None"
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    writer.writerow([trial_num, tone_type, reward_status, timestamp, elapsed_ms, lick_count])
+    writer.writerow([trial_num, tone_type, reward_status, timestamp, elapsed_ms, lick_count, link_status])
 
     elapsed_min = int(elapsed_ms // 60000)
     elapsed_sec = int((elapsed_ms % 60000) // 1000)
     reward_note = f" | Reward #{reward_count}" if reward_status == "Reward" else ""
-    print(f"[✓] Trial {trial_num}: {tone_type} | Reward: {reward_status} | Licks: {lick_count}{reward_note} | Elapsed: {elapsed_min}m{elapsed_sec:02d}s")
+    link_note = f" | Link: {link_status}" if link_status != "OK" else ""
+    print(f"[✓] Trial {trial_num}: {tone_type} | Reward: {reward_status} | Licks: {lick_count}{reward_note}{link_note} | Elapsed: {elapsed_min}m{elapsed_sec:02d}s")
 
     return tone_type, reward_status, lick_count
 
@@ -103,10 +144,11 @@ def save_lick_log():
     print(f"[💾] All licks saved to {LICK_LOG_PATH}")
 
 def main():
-    global trial_active, lick_count_in_trial, trial_num
+    global trial_active, lick_count_in_trial, trial_num, ser
 
     ser = open_serial(SERIAL_PORT, BAUD_RATE)
-    threading.Thread(target=lick_listener, args=(ser,), daemon=True).start()
+    link_up.set()
+    threading.Thread(target=lick_listener, daemon=True).start()
 
     experiment_start = time.time()
     reward_count = 0
@@ -115,7 +157,7 @@ def main():
 
     with open(TRIAL_LOG_PATH, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(['Trial', 'ToneType', 'RewardGiven', 'Timestamp', 'Elapsed_ms', 'LickCount'])
+        writer.writerow(['Trial', 'ToneType', 'RewardGiven', 'Timestamp', 'Elapsed_ms', 'LickCount', 'Link'])
 
         try:
             while True:
@@ -127,9 +169,20 @@ def main():
                     print("[🎯] Max reward count reached.")
                     break
 
-                send_trial(ser)
+                # Don't burn trials while the listener is reconnecting
+                if not link_up.is_set():
+                    link_up.wait(timeout=1.0)
+                    continue
+
+                with lock:
+                    epoch_at_send = link_epoch
+                try:
+                    send_trial()
+                except serial.SerialException as e:
+                    print(f"[🔌] Could not start trial: {e}")
+                    link_up.wait(timeout=1.0)
+                    continue
 
-            
                 try:
                     result = trial_result_queue.get(timeout=TRIAL_TIMEOUT)
                 except queue.Empty:
@@ -138,9 +191,10 @@ def main():
                 with lock:
                     trial_active = False
                     this_trial_licks = lick_count_in_trial
+                    link_status = "OK" if link_epoch == epoch_at_send else "LINK_LOST"
 
                 elapsed_ms = int((time.time() - experiment_start) * 1000)
-                tone, reward, count = log_trial(writer, trial_num, result, elapsed_ms, reward_count + 1, this_trial_licks)
+                tone, reward, count = log_trial(writer, trial_num, result, elapsed_ms, reward_count + 1, this_trial_licks, link_status)
 
                 if reward == "Reward":
                     reward_count += 1
@@ -11,12 +11,21 @@ BAUD_RATE = 115200
 MAX_RUNTIME_MIN = 30
 MAX_REWARD_COUNT = 300
 TRIAL_TIMEOUT = 15.0
+RECONNECT_BACKOFF_MIN = 0.5   # seconds, first retry after a USB drop
+RECONNECT_BACKOFF_MAX = 10.0  # seconds, retry interval cap
+LISTENER_ERROR_PAUSE = 1.0    # seconds between retries after an unexpected listener error
 timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
 LOG_PATH = f"data/tone_trial_log_{timestamp_str}.csv"
 
 # Queue for passing trial results
 trial_result_queue = queue.Queue()
 
+# Serial link, replaced by the listener after a USB drop
+ser = None
+link_up = threading.Event()
+link_epoch = 0  # bumped on every disconnect
+lock = threading.Lock()
+
 def open_serial(port, baudrate):
     try:
         ser = serial.Serial(port, baudrate, timeout=0.1)
@@ -27,10 +36,36 @@ def open_serial(port, baudrate):
         print(f"[✗] Failed to open serial port: {e}")
         exit(1)
 
-def send_trial(ser):
+def send_trial():
     ser.write(b'1')
 
-def lick_listener(ser):
+def reconnect_serial(err):
+    global ser, link_epoch
+    link_up.clear()
+    with lock:
+        link_epoch += 1
+    print(f"[🔌] Serial link lost: {err}")
+    try:
+        ser.close()
+    except Exception:
+        pass
+
+    delay = RECONNECT_BACKOFF_MIN
+    while True:
+        time.sleep(delay)
+        try:
+            new_ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
+            time.sleep(2)
+            break
+        except (serial.SerialException, OSError) as e:
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+            print(f"[↻] Reconnect failed ({e}), retrying in {delay:.1f}s")
+
+    ser = new_ser
+    print(f"[✓] Serial reconnected on {SERIAL_PORT}")
+    link_up.set()
+
+def lick_listener():
     buffer = b""
     while True:
         try:
@@ -47,10 +82,15 @@ def lick_listener(ser):
                             trial_result_queue.put(decoded)
                     buffer = lines[-1]
             time.sleep(0.001)
+        except (serial.SerialException, OSError) as e:
+            # POSIX unplug surfaces as a bare OSError from in_waiting
+            reconnect_serial(e)
+            buffer = b""
         except Exception as e:
             print(f"[⚠️] Listener error: {e}")
+            time.sleep(LISTENER_ERROR_PAUSE)
 
-def log_trial(csv_writer, trial_num, result_string, elapsed_ms, reward_count):
+def log_trial(csv_writer, trial_num, result_string, elapsed_ms, reward_count, link_status="OK"):
     try:
         tone_type, reward_status, lick_info = result_string.split(",")
         lick_count = int(lick_info.split(":")[1])
@@ -59,19 +99,23 @@ def log_trial(csv_writer, trial_num, result_string, elapsed_ms, reward_count):
         tone_type, reward_status, lick_count = "Unknown", "None", 0
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    csv_writer.writerow([trial_num, tone_type, reward_status, timestamp, elapsed_ms, lick_count])
+    csv_writer.writerow([trial_num, tone_type, reward_status, timestamp, elapsed_ms, lick_count, link_status])
 
     elapsed_min = int(elapsed_ms // 60000)
     elapsed_sec = int((elapsed_ms % 60000) // 1000)
     reward_note = f" | Reward #{reward_count}" if reward_status == "Reward" else ""
-    print(f"[✓] Trial {trial_num}: {tone_type} | Reward: {reward_status} | LickCount: {lick_count}{reward_note} | Elapsed: {elapsed_min}m{elapsed_sec:02d}s")
+    link_note = f" | Link: {link_status}" if link_status != "OK" else ""
+    print(f"[✓] Trial {trial_num}: {tone_type} | Reward: {reward_status} | LickCount: {lick_count}{reward_note}{link_note} | Elapsed: {elapsed_min}m{elapsed_sec:02d}s")
 
     return tone_type, reward_status, lick_count
 
 def main():
+    global ser
+
     ser = open_serial(SERIAL_PORT, BAUD_RATE)
 
-    threading.Thread(target=lick_listener, args=(ser,), daemon=True).start()
+    link_up.set()
+    threading.Thread(target=lick_listener, daemon=True).start()
 
     experiment_start = time.time()
     reward_licks = []
@@ -81,7 +125,7 @@ def main():
 
     with open(LOG_PATH, 'w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(['Trial', 'ToneType', 'RewardGiven', 'Timestamp', 'Elapsed_ms', 'LickCount'])
+        writer.writerow(['Trial', 'ToneType', 'RewardGiven', 'Timestamp', 'Elapsed_ms', 'LickCount', 'Link'])
 
         try:
             while True:
@@ -93,16 +137,30 @@ def main():
                     print("[🎯] Max reward count reached.")
                     break
 
+                # Don't burn trials while the listener is reconnecting
+                if not link_up.is_set():
+                    link_up.wait(timeout=1.0)
+                    continue
+
+                with lock:
+                    epoch_at_send = link_epoch
                 print(f"\n--- Trial {trial_num} ---")
-                send_trial(ser)
+                try:
+                    send_trial()
+                except serial.SerialException as e:
+                    print(f"[🔌] Could not start trial: {e}")
+                    link_up.wait(timeout=1.0)
+                    continue
 
                 try:
                     response = trial_result_queue.get(timeout=TRIAL_TIMEOUT)
                 except queue.Empty:
                     response = "TIMEOUT,None,LickCount:0"
+                with lock:
+                    link_status = "OK" if link_epoch == epoch_at_send else "LINK_LOST"
 
                 elapsed_ms = int((time.time() - experiment_start) * 1000)
-                tone_type, reward_status, lick_count = log_trial(writer, trial_num, response, elapsed_ms, reward_count + 1)
+                tone_type, reward_status, lick_count = log_trial(writer, trial_num, response, elapsed_ms, reward_count + 1, link_status)
 
                 if reward_status == "Reward":
                     reward_licks.append(lick_count)
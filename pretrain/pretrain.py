@@ -2,6 +2,7 @@ import serial
 import time
 import csv
 import threading
+import queue
 from datetime import datetime
 
 # === CONFIG ===
@@ -11,6 +12,7 @@ CALM_DOWN_MS = 1500
 MAX_RUNTIME_MIN = 10
 MAX_PUMP_COUNT = 300
 NO_LICK_TIMEOUT = 60  # seconds
+PUMP_ACK_TIMEOUT = 1.0  # seconds to wait for PUMP_DONE
 
 # === Timestamp and file paths ===
 timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -30,55 +32,105 @@ auto_pumped_this_trial = False
 exit_flag = threading.Event()
 lock = threading.Lock()
 
+# === Event stream (filled by serial_reader only)
+lick_events = queue.Queue()
+pump_acks = queue.Queue()
+pump_lock = threading.Lock()  # one pump in flight at a time
+watchdog_cond = threading.Condition()
+watchdog_deadline = None
+
 def send_pump():
     ser.write(b'P')
 
-def wait_for_calm_down(trial, lick_writer):
+def serial_reader():
     global last_lick_time
-    print("[Calm Down] Waiting for 1.5s without licks...")
-    last_lick = time.time() - start_time
-    while True:
-        line = ser.readline().decode().strip()
+    while not exit_flag.is_set():
+        line = ser.readline().decode(errors='ignore').strip()
         now = time.time() - start_time
         if line == "LICK":
-            print(f"[LICK] {now:.3f}")
-            lick_writer.writerow([trial, f"{now:.3f}"])
-            last_lick = now
             with lock:
                 last_lick_time = now
-        if now - last_lick >= CALM_DOWN_MS / 1000:
-            print("[Calm Down Complete]")
-            break
+            rearm_watchdog(now)
+            lick_events.put(now)
+        elif line == "PUMP_DONE":
+            pump_acks.put(now)
+
+def pump_and_wait_ack():
+    # Caller holds pump_lock; stale acks from a timed-out pump are dropped
+    while not pump_acks.empty():
+        pump_acks.get_nowait()
+    send_pump()
+    try:
+        return pump_acks.get(timeout=PUMP_ACK_TIMEOUT)
+    except queue.Empty:
+        return None
 
-def auto_pump_monitor(pump_writer):
-    global last_lick_time, pump_count, auto_pumped_this_trial
+def wait_for_calm_down(trial, lick_writer):
+    print("[Calm Down] Waiting for 1.5s without licks...")
+    last_lick = time.time() - start_time
+    while True:
+        remaining = CALM_DOWN_MS / 1000 - (time.time() - start_time - last_lick)
+        if remaining <= 0:
+            break
+        try:
+            lick_t = lick_events.get(timeout=remaining)
+        except queue.Empty:
+            break
+        print(f"[LICK] {lick_t:.3f}")
+        lick_writer.writerow([trial, f"{lick_t:.3f}"])
+        last_lick = max(last_lick, lick_t)
+    print("[Calm Down Complete]")
+
+# === No-lick watchdog
+def rearm_watchdog(from_time):
+    # Only ever move the deadline forward: a lick seen while an auto pump
+    # waits for its ack must not be overwritten by the pump's own re-arm
+    global watchdog_deadline
+    with watchdog_cond:
+        deadline = from_time + NO_LICK_TIMEOUT
+        if watchdog_deadline is None or deadline > watchdog_deadline:
+            watchdog_deadline = deadline
+        watchdog_cond.notify()
+
+def no_lick_watchdog(pump_writer):
+    global watchdog_deadline
     while not exit_flag.is_set():
-        time.sleep(0.5)
-        now = time.time() - start_time
-        with lock:
-            since_last = now - last_lick_time
-        if since_last >= NO_LICK_TIMEOUT:
-            print(f"[AUTO] {NO_LICK_TIMEOUT}s no lick. Sending pump at {now:.3f}")
-            pump_writer.writerow(["Auto",f"{now:.3f}", "AUTO"])  
-            send_pump()
-            wait_start = time.time()
-            while time.time() - wait_start < 0.2:
-                line = ser.readline().decode().strip()
-                now = time.time() - start_time
-                if line == "PUMP_DONE":
-                    print(f"[AUTO] Got PUMP_DONE at {now:.3f}")
-                    with lock:
-                        last_lick_time = now
-                        pump_count += 1
-                        auto_pumped_this_trial = True
-                    break
-            else:
-                with lock:
-                    last_lick_time = time.time() - start_time
+        with watchdog_cond:
+            if watchdog_deadline is None:
+                watchdog_cond.wait()
+                continue
+            remaining = watchdog_deadline - (time.time() - start_time)
+            if remaining > 0:
+                watchdog_cond.wait(timeout=remaining)
+                continue
+            scheduled = watchdog_deadline
+            watchdog_deadline = None
+        if exit_flag.is_set():
+            break
+        auto_pump(pump_writer, scheduled)
+
+def auto_pump(pump_writer, scheduled):
+    global pump_count, auto_pumped_this_trial
+    with pump_lock:
+        fired = time.time() - start_time
+        print(f"[AUTO] {NO_LICK_TIMEOUT}s no lick. Sending pump at {fired:.3f} "
+              f"(scheduled {scheduled:.3f}, late {(fired - scheduled) * 1000:.1f} ms)")
+        ack = pump_and_wait_ack()
+    if ack is None:
+        print(f"[AUTO] No PUMP_DONE within {PUMP_ACK_TIMEOUT}s")
+    else:
+        print(f"[AUTO] Got PUMP_DONE at {ack:.3f}")
+    with lock:
+        pump_writer.writerow(["Auto", f"{fired:.3f}", "AUTO", f"{scheduled:.3f}",
+                              f"{ack:.3f}" if ack is not None else ""])
+        if ack is not None:
+            pump_count += 1
+        auto_pumped_this_trial = True
+    rearm_watchdog(fired)
 
 
 def main():
-    global pump_count, last_lick_time, auto_pumped_this_trial
+    global pump_count, auto_pumped_this_trial
 
     trial = 0
     print("[System Ready] Waiting for licks...")
@@ -87,13 +139,12 @@ def main():
         lick_writer = csv.writer(lick_f)
         pump_writer = csv.writer(pump_f)
         lick_writer.writerow(['Trial', 'LickTime'])
-        pump_writer.writerow(['Trial', 'PumpTime', 'Source'])
-
-        last_lick_time = time.time() - start_time
+        pump_writer.writerow(['Trial', 'PumpTime', 'Source', 'ScheduledTime', 'AckTime'])
 
-        # Start auto pump background thread
-        thread = threading.Thread(target=auto_pump_monitor, args=(pump_writer,), daemon=True)
-        thread.start()
+        # Reader feeds the event queues; watchdog fires NO_LICK_TIMEOUT after the last lick
+        rearm_watchdog(time.time() - start_time)
+        threading.Thread(target=serial_reader, daemon=True).start()
+        threading.Thread(target=no_lick_watchdog, args=(pump_writer,), daemon=True).start()
 
         while True:
             now = time.time() - start_time
@@ -116,32 +167,31 @@ def main():
             if skip_lick:
                 print("[AUTO] Skipping lick wait due to auto pump")
             else:
-                # Wait for LICK
+                # Wait for LICK (short timeouts keep Ctrl+C responsive)
                 while True:
-                    line = ser.readline().decode().strip()
-                    now = time.time() - start_time
-                    if line == "LICK":
-                        print(f"[LICK] {now:.3f}")
-                        lick_writer.writerow([trial, f"{now:.3f}"])
-                        with lock:
-                            last_lick_time = now
-                        send_pump()
-                        break
-
-                # Wait for PUMP_DONE
-                while True:
-                    line = ser.readline().decode().strip()
-                    now = time.time() - start_time
-                    if line == "PUMP_DONE":
-                        print(f"[PUMP] {now:.3f}")
-                        pump_writer.writerow([trial, f"{now:.3f}", "TRIAL"])
-                        with lock:
-                            pump_count += 1
+                    try:
+                        lick_t = lick_events.get(timeout=0.5)
                         break
+                    except queue.Empty:
+                        pass
+                print(f"[LICK] {lick_t:.3f}")
+                lick_writer.writerow([trial, f"{lick_t:.3f}"])
+
+                # Pump and wait for PUMP_DONE
+                with pump_lock:
+                    ack = pump_and_wait_ack()
+                if ack is None:
+                    print(f"[PUMP] No PUMP_DONE within {PUMP_ACK_TIMEOUT}s")
+                else:
+                    print(f"[PUMP] {ack:.3f}")
+                    with lock:
+                        pump_writer.writerow([trial, f"{ack:.3f}", "TRIAL", "", ""])
+                        pump_count += 1
 
             wait_for_calm_down(trial, lick_writer)
             lick_f.flush()
-            pump_f.flush()
+            with lock:
+                pump_f.flush()
 
     exit_flag.set()
     print(f"\n[Finished] Trials: {trial} | Pumps: {pump_count}")
@@ -3,6 +3,8 @@ import time
 import csv
 import threading
 import queue
+import random
+from collections import deque
 from datetime import datetime
 
 # ==== CONFIG ====
@@ -10,12 +12,37 @@ SERIAL_PORT = 'COM5'
 BAUD_RATE = 115200
 MAX_RUNTIME_MIN = 15
 MAX_REWARD_COUNT = 300
-TRIAL_TIMEOUT = 10.0
+TRIAL_TIMEOUT = 15.0  # covers one trial plus the firmware's 5-8s post-trial delay
+RECONNECT_BACKOFF_MIN = 0.5   # seconds, first retry after a USB drop
+RECONNECT_BACKOFF_MAX = 10.0  # seconds, retry interval cap
+LISTENER_ERROR_PAUSE = 1.0    # seconds between retries after an unexpected listener error
+LIVE_PLOT = False             # live lick raster/PSTH window (needs numpy + matplotlib)
+
+# ==== SCHEDULE ====
+SCHEDULE_SEED = None      # None = seed from clock (logged either way)
+BLOCK_SIZE = 20           # trials per upload, must be even and <= MAX_BLOCK
+MAX_BLOCK = 32            # same as MAX_BLOCK in reward2in1.ino
+MAX_SAME_TONE = 5         # same limit as firmware: never 5 of one tone in a row
+REWARD_PROB_PCT = 95      # Tone1_low trials that deliver water
+NONREWARD_PROB_PCT = 20   # Tone2_high trials that deliver water
+TONE_NAMES = ("Tone1_low", "Tone2_high")
+
+# ==== EARLY STOP / ALERTS ====
+WINDOW_TRIALS = 40             # sliding window for online performance
+REPORT_EVERY = 10              # print window stats every N trials
+HIT_MIN_LICKS = 1              # Tone1_low trial counts as a hit with this many licks
+STOP_ON_CRITERION = True
+CRITERION_LICK_RATIO = 2.0     # reward / no-reward mean licks over a full window
+CRITERION_HIT_RATE = 0.8
+STOP_TIMEOUT_RUN = 10          # consecutive TIMEOUT trials (link OK) before stopping
+STOP_ENGAGEMENT = 0.1          # stop when fewer window trials have any lick
+ALERT_ENGAGEMENT = 0.3         # warn (once) when engagement drops below this
 
 # ==== LOG FILES ====
 timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
 TRIAL_LOG_PATH = f"Data/m76/m76_RC_test_trial_log_{timestamp_str}.csv"
 LICK_LOG_PATH = f"Data/m76/m76_RC_test_lick_log_{timestamp_str}.csv"
+SCHEDULE_LOG_PATH = f"Data/m76/m76_RC_test_schedule_{timestamp_str}.csv"
 
 # ==== GLOBAL STATE ====
 trial_result_queue = queue.Queue()
@@ -26,6 +53,11 @@ last_lick_time = 0
 trial_num = 1
 ttl_triggered = threading.Event()
 lock = threading.Lock()
+ser = None
+session_mode = None
+link_up = threading.Event()
+link_epoch = 0  # bumped on every disconnect
+plot_queue = None
 
 # ==== SERIAL ====
 def open_serial(port, baudrate):
@@ -38,17 +70,227 @@ def open_serial(port, baudrate):
         print(f"[✗] Serial error: {e}")
         exit(1)
 
-def send_trial(ser):
-    ser.write(b'1')
+def block_tag(upload_id):
+    return chr(ord('A') + upload_id % 26)
 
-def send_reset(ser):
-    ser.write(b'r')
-    print("[↩] Sent reset signal to Arduino.")
+def send_block(tag, block):
+    # Tag byte, then one code byte per trial: '0' + (tone | reward << 1), see reward2in1.ino
+    codes = bytes(ord('0') + (tone | (reward << 1)) for tone, reward in block)
+    ser.write(b'S' + tag.encode() + codes + b'\n')
+
+def send_reset():
+    try:
+        ser.write(b'r')
+        print("[↩] Sent reset signal to Arduino.")
+    except serial.SerialException as e:
+        print(f"[✗] Could not send reset: {e}")
+
+def restore_firmware_state(new_ser):
+    # The board reboots when the port is reopened and waits for TTL again.
+    # Once the session has started, skip the TTL wait like testing mode does.
+    if session_mode == "testing" or ttl_triggered.is_set():
+        new_ser.write(b't')
+        print("[🧪] Re-sent testing mode after reconnect.")
+    else:
+        print("[⌛] Reconnected, still waiting for TTL trigger...")
+
+def reconnect_serial(err):
+    global ser, link_epoch, trial_active
+    link_up.clear()
+    with lock:
+        link_epoch += 1
+        trial_active = False
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    lick_log.append([ts, "LINK_LOST"])
+    print(f"[🔌] Serial link lost: {err}")
+    try:
+        ser.close()
+    except Exception:
+        pass
+
+    delay = RECONNECT_BACKOFF_MIN
+    while True:
+        time.sleep(delay)
+        new_ser = None
+        try:
+            new_ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1)
+            time.sleep(2)
+            restore_firmware_state(new_ser)
+            break
+        except (serial.SerialException, OSError) as e:
+            # Release the port, otherwise Windows refuses every later open
+            if new_ser is not None:
+                try:
+                    new_ser.close()
+                except Exception:
+                    pass
+            delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+            print(f"[↻] Reconnect failed ({e}), retrying in {delay:.1f}s")
+
+    ser = new_ser
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    lick_log.append([ts, "LINK_RESTORED"])
+    print(f"[✓] Serial reconnected on {SERIAL_PORT}")
+    link_up.set()
+
+# ==== SCHEDULE ====
+def run_length_ok(tones, last_tone, run):
+    for tone in tones:
+        run = run + 1 if tone == last_tone else 1
+        last_tone = tone
+        if run >= MAX_SAME_TONE:
+            return False
+    return True
+
+def schedule_blocks(seed):
+    """Yield (block_num, [(tone, reward), ...]) forever.
+
+    Each block has equal counts of both tones, respects MAX_SAME_TONE across
+    block boundaries, and rewards a fixed share of each tone's trials. The
+    fractional part of each block's reward count is carried into the next
+    block, so the long-run share matches REWARD_PROB_PCT/NONREWARD_PROB_PCT.
+    """
+    rng = random.Random(seed)
+    last_tone, run = -1, 0
+    carry = {0: 0, 1: 0}  # owed rewards, in hundredths of a trial
+    block_num = 0
+    while True:
+        block_num += 1
+        tones = [0, 1] * (BLOCK_SIZE // 2)
+        rng.shuffle(tones)
+        while not run_length_ok(tones, last_tone, run):
+            rng.shuffle(tones)
+
+        rewards = [0] * BLOCK_SIZE
+        for tone, pct in ((0, REWARD_PROB_PCT), (1, NONREWARD_PROB_PCT)):
+            idx = [i for i, t in enumerate(tones) if t == tone]
+            n_reward, carry[tone] = divmod(len(idx) * pct + carry[tone], 100)
+            for i in rng.sample(idx, n_reward):
+                rewards[i] = 1
+
+        for tone in tones:
+            run = run + 1 if tone == last_tone else 1
+            last_tone = tone
+        yield block_num, list(zip(tones, rewards))
+
+def check_schedule_config():
+    problems = []
+    if BLOCK_SIZE <= 0 or BLOCK_SIZE % 2 or BLOCK_SIZE > MAX_BLOCK:
+        problems.append(f"BLOCK_SIZE must be even and between 2 and {MAX_BLOCK}, got {BLOCK_SIZE}")
+    if not (isinstance(MAX_SAME_TONE, int) and MAX_SAME_TONE >= 2):
+        problems.append(f"MAX_SAME_TONE must be a whole number of at least 2, got {MAX_SAME_TONE!r}")
+    for name, pct in (("REWARD_PROB_PCT", REWARD_PROB_PCT), ("NONREWARD_PROB_PCT", NONREWARD_PROB_PCT)):
+        if not (isinstance(pct, int) and 0 <= pct <= 100):
+            problems.append(f"{name} must be a whole percentage 0-100, got {pct!r}")
+    for problem in problems:
+        print(f"[✗] Schedule config: {problem}")
+    if problems:
+        exit(1)
+
+def log_schedule(writer, seed, upload_id, tag, trials):
+    # One row per uploaded trial; a remainder re-uploaded after a reconnect
+    # repeats its (Block, BlockTrial) rows under the new Upload/Tag
+    for block_num, block_trial, tone, reward in trials:
+        writer.writerow([seed, upload_id, tag, block_num, block_trial,
+                         TONE_NAMES[tone], "Reward" if reward else "None"])
+
+# ==== PERFORMANCE WINDOW ====
+class WindowStats:
+    """Rolling performance over the last `size` trials, O(1) per update."""
+
+    def __init__(self, size):
+        self.size = size
+        self.trials = deque()
+        self.reward_n = self.reward_licks = 0
+        self.none_n = self.none_licks = 0
+        self.go_n = self.hits = 0
+        self.engaged = 0
+        self.licks = 0
+        self.timeout_run = 0
+
+    def update(self, tone, reward, licks, elapsed_ms):
+        entry = (tone, reward, licks, elapsed_ms)
+        self._apply(entry, 1)
+        self.trials.append(entry)
+        if len(self.trials) > self.size:
+            self._apply(self.trials.popleft(), -1)
+        self.timeout_run = self.timeout_run + 1 if tone == "TIMEOUT" else 0
+
+    def _apply(self, entry, sign):
+        tone, reward, licks, _ = entry
+        self.licks += sign * licks
+        self.engaged += sign * (licks > 0)
+        if tone == "TIMEOUT":
+            return
+        if reward == "Reward":
+            self.reward_n += sign
+            self.reward_licks += sign * licks
+        else:
+            self.none_n += sign
+            self.none_licks += sign * licks
+        if tone == TONE_NAMES[0]:
+            self.go_n += sign
+            self.hits += sign * (licks >= HIT_MIN_LICKS)
+
+    @property
+    def full(self):
+        return len(self.trials) >= self.size
+
+    @property
+    def lick_ratio(self):
+        avg_reward = self.reward_licks / self.reward_n if self.reward_n else 0
+        avg_none = self.none_licks / self.none_n if self.none_n else 0
+        if avg_none:
+            return avg_reward / avg_none
+        # No no-reward licks: only a licking animal is perfectly discriminating
+        return float('inf') if avg_reward > 0 else float('nan')
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.go_n if self.go_n else 0
+
+    @property
+    def engagement(self):
+        return self.engaged / len(self.trials) if self.trials else 0
+
+    @property
+    def lick_rate(self):
+        # licks per second across the window's span
+        if len(self.trials) < 2:
+            return 0
+        span_s = (self.trials[-1][3] - self.trials[0][3]) / 1000
+        return self.licks / span_s if span_s > 0 else 0
+
+    def summary(self):
+        return (f"ratio {self.lick_ratio:.2f} | hit {self.hit_rate:.0%} | "
+                f"engaged {self.engagement:.0%} | {self.lick_rate:.2f} licks/s")
+
+def stop_reason(stats):
+    if stats.timeout_run >= STOP_TIMEOUT_RUN:
+        return f"{stats.timeout_run} TIMEOUT trials in a row"
+    if not stats.full:
+        return None
+    if stats.engagement < STOP_ENGAGEMENT:
+        return f"disengaged ({stats.engagement:.0%} of last {stats.size} trials licked)"
+    if (STOP_ON_CRITERION and stats.lick_ratio >= CRITERION_LICK_RATIO
+            and stats.hit_rate >= CRITERION_HIT_RATE):
+        return f"criterion reached ({stats.summary()})"
+    return None
+
+# ==== LIVE PLOT ====
+def plot_event(*event):
+    if plot_queue is None:
+        return
+    try:
+        plot_queue.put_nowait(event)
+    except queue.Full:
+        pass  # drop frames rather than slow the listener
 
 # ==== LICK LISTENER ====
-def lick_listener(ser):
+def lick_listener():
     global trial_active, lick_count_in_trial, last_lick_time, trial_num
     buffer = b""
+    block_trial = None  # (tag, index) announced for the running trial
     while True:
         try:
             data = ser.read(ser.in_waiting or 1)
@@ -65,30 +307,84 @@ def lick_listener(ser):
                             ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
                             print(f"[👅]{decoded}")
                             lick_log.append([ts, decoded])
+                            plot_event("lick", now)
                             with lock:
                                 if trial_active:
                                     lick_count_in_trial += 1
 
                         elif decoded.startswith("Tone"):
-                            trial_result_queue.put(decoded)
+                            trial_result_queue.put((decoded, block_trial))
+                            block_trial = None
+                            plot_event("result", now, *decoded.split(",")[:2])
 
                         elif decoded.startswith("TRIAL_START"):
                             with lock:
                                 lick_count_in_trial = 0
                                 trial_active = True
+                            plot_event("trial_start", now)
                             print(f"\n-- Trial {trial_num} --")
 
+                        elif decoded.startswith("BLOCK_TRIAL"):
+                            try:
+                                _, tag, idx = decoded.split(",")
+                                block_trial = (tag, int(idx))
+                            except ValueError:
+                                print(f"[!] Bad block trial line: {repr(decoded)}")
+                                block_trial = None
+
+                        elif decoded.startswith("BLOCK_LOADED"):
+                            print(f"[📦] {decoded}")
+
                         elif decoded.startswith("x✅"):
                             print(f"[🚀] TTL triggered by: {repr(decoded)}")
                             ttl_triggered.set()
 
                     buffer = lines[-1]
             time.sleep(0.001)
+        except (serial.SerialException, OSError) as e:
+            # POSIX unplug surfaces as a bare OSError from in_waiting
+            reconnect_serial(e)
+            buffer = b""
+            block_trial = None
         except Exception as e:
             print(f"[⚠️] Listener error: {e}")
+            time.sleep(LISTENER_ERROR_PAUSE)
+
+def wait_for_result(pending, tag, epoch):
+    """Wait for the result of pending[0]; pop and return (result, pending entry).
+
+    Results are matched on the (tag, index) the board announced, so a result
+    arriving after its TIMEOUT, or from a superseded upload, is dropped
+    instead of being booked against the next scheduled trial. A link drop
+    ends the wait at once, since the rebooted board needs a re-upload.
+    Returns (None, None) once the board has reported past the whole upload.
+    """
+    deadline = time.time() + TRIAL_TIMEOUT
+    while pending:
+        with lock:
+            link_lost = link_epoch != epoch
+        remaining = deadline - time.time()
+        if link_lost or remaining <= 0:
+            return "TIMEOUT,None,LickCount:0", pending.pop(0)
+        try:
+            # Short waits so a link drop is noticed without waiting out the timeout
+            result, block_trial = trial_result_queue.get(timeout=min(remaining, 0.5))
+        except queue.Empty:
+            continue
+        if block_trial is None or block_trial[0] != tag or block_trial[1] < pending[0][0]:
+            print(f"[!] Dropping late result {block_trial}: {result}")
+            continue
+        while pending and pending[0][0] < block_trial[1]:
+            skipped = pending.pop(0)
+            print(f"[!] Board skipped block {skipped[1]} trial {skipped[2]} (upload {tag})")
+        if pending and pending[0][0] == block_trial[1]:
+            return result, pending.pop(0)
+        print(f"[!] Result {block_trial} is not in the schedule: {result}")
+    return None, None
 
 # ==== LOGGING ====
-def log_trial(writer, trial_num, result_string, elapsed_ms, reward_count, lick_count):
+def log_trial(writer, trial_num, result_string, elapsed_ms, reward_count, lick_count, link_status="OK",
+              block_num="", block_trial=""):
     try:
         tone_type, reward_status, _ = result_string.split(",")
     except Exception as e:
@@ -96,12 +392,14 @@ def log_trial(writer, trial_num, result_string, elapsed_ms, reward_count, lick_c
         tone_type, reward_status = "Unknown", "None"
 
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    writer.writerow([trial_num, tone_type, reward_status, timestamp, elapsed_ms, lick_count])
+    writer.writerow([trial_num, tone_type, reward_status, timestamp, elapsed_ms, lick_count, link_status,
+                     block_num, block_trial])
 
     elapsed_min = int(elapsed_ms // 60000)
     elapsed_sec = int((elapsed_ms % 60000) // 1000)
     reward_note = f" | Reward #{reward_count}" if reward_status == "Reward" else ""
-    print(f"[✓] Trial {trial_num}: {tone_type} | Reward: {reward_status} | Licks: {lick_count}{reward_note} | Elapsed: {elapsed_min}m{elapsed_sec:02d}s")
+    link_note = f" | Link: {link_status}" if link_status != "OK" else ""
+    print(f"[✓] Trial {trial_num}: {tone_type} | Reward: {reward_status} | Licks: {lick_count}{reward_note}{link_note} | Elapsed: {elapsed_min}m{elapsed_sec:02d}s")
 
     return tone_type, reward_status, lick_count
 
@@ -129,11 +427,17 @@ def choose_mode():
 
 # ==== MAIN ====
 def main():
-    global trial_active, lick_count_in_trial, trial_num
+    global trial_active, lick_count_in_trial, trial_num, ser, session_mode, plot_queue
 
+    check_schedule_config()
     mode = choose_mode()  # 🆕 select mode
+    session_mode = mode
+    if LIVE_PLOT:
+        from liveplot import start_live_plot
+        plot_queue = start_live_plot()
     ser = open_serial(SERIAL_PORT, BAUD_RATE)
-    threading.Thread(target=lick_listener, args=(ser,), daemon=True).start()
+    link_up.set()
+    threading.Thread(target=lick_listener, daemon=True).start()
 
     if mode == "recording":
         print("[⌛] Waiting for TTL trigger...")
@@ -142,7 +446,7 @@ def main():
                 pass
         except KeyboardInterrupt:
             print("\n[🛑] Interrupted while waiting for TTL. Exiting.")
-            send_reset(ser)
+            send_reset()
             ser.close()
             exit(0)
     
@@ -151,38 +455,86 @@ def main():
         ser.write(b't')  #
         time.sleep(0.5)
 
+    seed = SCHEDULE_SEED if SCHEDULE_SEED is not None else int(time.time())
+    print(f"[🎲] Schedule seed: {seed}")
+    schedule = schedule_blocks(seed)
+    pending = []         # (index, block, block trial, tone, reward) uploaded but not yet reported
+    block_epoch = None   # link_epoch when pending was last uploaded
+    upload_id = 0        # every upload gets a new tag, so stale results can be told apart
+
+    stats = WindowStats(WINDOW_TRIALS)
+    engagement_alerted = False
+    stop_note = "Interrupted"
+
     experiment_start = time.time()
     reward_count = 0
     reward_licks = []
     no_reward_licks = []
 
-    with open(TRIAL_LOG_PATH, 'w', newline='') as f:
+    with open(TRIAL_LOG_PATH, 'w', newline='') as f, open(SCHEDULE_LOG_PATH, 'w', newline='') as sf:
         writer = csv.writer(f)
-        writer.writerow(['Trial', 'ToneType', 'RewardGiven', 'Timestamp', 'Elapsed_ms', 'LickCount'])
+        writer.writerow(['Trial', 'ToneType', 'RewardGiven', 'Timestamp', 'Elapsed_ms', 'LickCount', 'Link',
+                         'Block', 'BlockTrial'])
+        schedule_writer = csv.writer(sf)
+        schedule_writer.writerow(['Seed', 'Upload', 'Tag', 'Block', 'BlockTrial', 'ToneType', 'RewardGiven'])
 
         try:
             while True:
                 elapsed_time = time.time() - experiment_start
                 if elapsed_time > MAX_RUNTIME_MIN * 60:
                     print("[⏱️] Max runtime reached.")
+                    stop_note = "Max runtime"
                     break
                 if reward_count >= MAX_REWARD_COUNT:
                     print("[🎯] Max reward count reached.")
+                    stop_note = "Max reward count"
                     break
 
-                send_trial(ser)
+                # Don't burn trials while the listener is reconnecting
+                if not link_up.is_set():
+                    link_up.wait(timeout=1.0)
+                    continue
 
-                try:
-                    result = trial_result_queue.get(timeout=TRIAL_TIMEOUT)
-                except queue.Empty:
-                    result = "TIMEOUT,None,LickCount:0"
+                with lock:
+                    epoch_at_send = link_epoch
+                # Upload the next block once the board has run the last one,
+                # or re-upload the remainder if the board rebooted meanwhile
+                if not pending or block_epoch != epoch_at_send:
+                    if not pending:
+                        block_num, block = next(schedule)
+                        trials = [(block_num, i, tone, reward) for i, (tone, reward) in enumerate(block, start=1)]
+                    else:
+                        trials = [entry[1:] for entry in pending]
+                    # Kept even if the upload fails, so the same trials are retried
+                    pending = [(i, *trial) for i, trial in enumerate(trials)]
+                    block_epoch = None
+                    upload_id += 1
+                    try:
+                        send_block(block_tag(upload_id), [(tone, reward) for _, _, tone, reward in trials])
+                    except serial.SerialException as e:
+                        print(f"[🔌] Could not upload schedule block: {e}")
+                        link_up.wait(timeout=1.0)
+                        continue
+                    log_schedule(schedule_writer, seed, upload_id, block_tag(upload_id), trials)
+                    sf.flush()
+                    block_epoch = epoch_at_send
+
+                result, entry = wait_for_result(pending, block_tag(upload_id), epoch_at_send)
+                if result is None:
+                    continue  # nothing left of this upload; send the next block
+                _, block_num, block_trial, scheduled_tone, _ = entry
 
                 with lock:
                     trial_active = False
                     this_trial_licks = lick_count_in_trial
+                    link_status = "OK" if link_epoch == epoch_at_send else "LINK_LOST"
+
+                if not result.startswith(("TIMEOUT", TONE_NAMES[scheduled_tone])):
+                    print(f"[!] Expected {TONE_NAMES[scheduled_tone]}, board reported {result}")
 
                 elapsed_ms = int((time.time() - experiment_start) * 1000)
-                tone, reward, count = log_trial(writer, trial_num, result, elapsed_ms, reward_count + 1, this_trial_licks)
+                tone, reward, count = log_trial(writer, trial_num, result, elapsed_ms, reward_count + 1,
+                                                this_trial_licks, link_status, block_num, block_trial)
 
                 if reward == "Reward":
                     reward_count += 1
@@ -190,13 +542,30 @@ def main():
                 else:
                     no_reward_licks.append(this_trial_licks)
 
+                # Trials cut short by a disconnect say nothing about the animal
+                if link_status == "OK":
+                    stats.update(tone, reward, this_trial_licks, elapsed_ms)
+                if trial_num % REPORT_EVERY == 0:
+                    print(f"[📈] Last {len(stats.trials)} trials: {stats.summary()}")
+                if stats.full and stats.engagement < ALERT_ENGAGEMENT:
+                    if not engagement_alerted:
+                        print(f"[⚠️] Low engagement: {stats.summary()}")
+                        engagement_alerted = True
+                else:
+                    engagement_alerted = False
+
                 trial_num += 1
-                time.sleep(0.5)
+
+                reason = stop_reason(stats)
+                if reason:
+                    print(f"[🏁] Early stop: {reason}")
+                    stop_note = f"Early stop: {reason}"
+                    break
 
         except KeyboardInterrupt:
             print("\n[🛑] Interrupted by user.")
         finally:
-            send_reset(ser)
+            send_reset()
 
     # Summary
     def avg(x): return sum(x) / len(x) if x else 0
@@ -209,11 +578,14 @@ def main():
     save_lick_log()
     ser.close()
     print(f"[✔] Trial data saved to {TRIAL_LOG_PATH}")
+    print(f"[✔] Schedule (seed {seed}) saved to {SCHEDULE_LOG_PATH}")
     with open(TRIAL_LOG_PATH, 'a', newline='') as f:
         writer = csv.writer(f)
         writer.writerow([])
         writer.writerow(["Avg Reward licks", f"{avg(reward_licks):.2f}"])
         writer.writerow(["Avg NO-Reward licks", f"{avg(no_reward_licks):.2f}"])
+        writer.writerow(["Last window", stats.summary()])
+        writer.writerow(["Stop reason", stop_note])
         #writer.writerow(["ratio", f"{ratio:.2f}" ])
         
 
@@ -0,0 +1,194 @@
+"""Live lick raster, PSTH and cumulative rewards for 2in1.py.
+
+Runs in its own process and is fed (timestamp, event) tuples through a
+multiprocessing queue, so drawing never holds up the serial listener:
+    ("trial_start", t)
+    ("lick", t)
+    ("result", t, tone_type, reward_status)
+"""
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+
+import numpy as np
+
+FPS = 10
+QUEUE_SIZE = 10000
+PRE_S = 1.0              # raster/PSTH window before TRIAL_START (s)
+POST_S = 4.0             # ... and after
+BIN_S = 0.1              # PSTH bin width (s)
+RASTER_TRIALS = 100      # raster keeps only the most recent trials
+MAX_CUM_POINTS = 500     # cumulative-reward trace is decimated to this many points
+MAX_EVENTS_PER_FRAME = 2000
+TONES = ("Tone1_low", "Tone2_high")
+COLORS = {"Tone1_low": "tab:blue", "Tone2_high": "tab:orange"}
+
+
+def start_live_plot():
+    q = mp.Queue(maxsize=QUEUE_SIZE)
+    mp.Process(target=run_plot, args=(q,), daemon=True).start()
+    return q
+
+
+class SessionView:
+    """Aligns licks to trial onsets and keeps the plot data incrementally."""
+
+    def __init__(self):
+        self.edges = np.arange(-PRE_S, POST_S + BIN_S / 2, BIN_S)
+        self.recent_licks = deque()
+        self.current = None          # [t0, tone, [rel lick times]]
+        self.raster = deque(maxlen=RASTER_TRIALS)  # (tone, rel times)
+        self.psth_counts = {tone: np.zeros(len(self.edges) - 1) for tone in TONES}
+        self.psth_trials = {tone: 0 for tone in TONES}
+        self.cum_rewards = []
+        self.rewards = 0
+        self.latest = 0.0
+        self.dirty = False
+
+    def handle(self, event):
+        kind, t = event[0], event[1]
+        self.latest = max(self.latest, t)
+        if kind == "lick":
+            self.recent_licks.append(t)
+            while self.recent_licks and t - self.recent_licks[0] > PRE_S:
+                self.recent_licks.popleft()
+            if self.current and t - self.current[0] <= POST_S:
+                self.current[2].append(t - self.current[0])
+        elif kind == "trial_start":
+            self.finish_trial()
+            pre = [lt - t for lt in self.recent_licks if t - lt <= PRE_S]
+            self.current = [t, None, pre]
+        elif kind == "result" and len(event) == 4:
+            tone, reward = event[2], event[3]
+            if self.current:
+                self.current[1] = tone
+            if reward == "Reward":
+                self.rewards += 1
+            self.cum_rewards.append(self.rewards)
+            self.dirty = True
+
+    def finish_trial(self):
+        if not self.current:
+            return
+        _, tone, rel = self.current
+        self.current = None
+        if tone not in self.psth_counts:
+            return
+        rel = np.asarray(rel)
+        self.raster.append((tone, rel))
+        self.psth_counts[tone] += np.histogram(rel, self.edges)[0]
+        self.psth_trials[tone] += 1
+        self.dirty = True
+
+    def tick(self):
+        if self.current and self.latest - self.current[0] > POST_S:
+            self.finish_trial()
+
+    def raster_points(self, tone):
+        xs, ys = [], []
+        for row, (t, rel) in enumerate(self.raster):
+            if t == tone and len(rel):
+                xs.append(rel)
+                ys.append(np.full(len(rel), row))
+        if not xs:
+            return np.empty(0), np.empty(0)
+        return np.concatenate(xs), np.concatenate(ys)
+
+    def psth(self, tone):
+        n = self.psth_trials[tone]
+        return self.psth_counts[tone] / (n * BIN_S) if n else self.psth_counts[tone]
+
+    def cum_trace(self):
+        n = len(self.cum_rewards)
+        if not n:
+            return np.empty(0), np.empty(0)
+        idx = np.arange(0, n, max(1, -(-n // MAX_CUM_POINTS)))
+        if idx[-1] != n - 1:
+            idx = np.append(idx, n - 1)
+        return idx + 1, np.asarray(self.cum_rewards)[idx]
+
+
+def run_plot(q):
+    import matplotlib.pyplot as plt
+
+    view = SessionView()
+    fig, (ax_raster, ax_psth, ax_cum) = plt.subplots(3, 1, figsize=(7, 9))
+    fig.canvas.manager.set_window_title("Lick raster / PSTH")
+
+    ax_raster.set_xlim(-PRE_S, POST_S)
+    ax_raster.set_ylim(-0.5, RASTER_TRIALS - 0.5)
+    ax_raster.axvline(0, color='k', lw=0.8)
+    ax_raster.set_ylabel(f"Trial (last {RASTER_TRIALS})")
+    ax_psth.set_xlim(-PRE_S, POST_S)
+    ax_psth.set_ylim(0, 5)
+    ax_psth.axvline(0, color='k', lw=0.8)
+    ax_psth.set_xlabel("Time from TRIAL_START (s)")
+    ax_psth.set_ylabel("Licks/s")
+    ax_cum.set_xlim(1, 100)
+    ax_cum.set_ylim(0, 50)
+    ax_cum.set_xlabel("Trial")
+    ax_cum.set_ylabel("Cumulative rewards")
+
+    centers = (view.edges[:-1] + view.edges[1:]) / 2
+    raster_lines, psth_lines = {}, {}
+    for tone in TONES:
+        raster_lines[tone], = ax_raster.plot([], [], '|', color=COLORS[tone], ms=4, animated=True, label=tone)
+        psth_lines[tone], = ax_psth.plot(centers, np.zeros(len(centers)), color=COLORS[tone],
+                                         drawstyle='steps-mid', animated=True)
+    cum_line, = ax_cum.plot([], [], color='tab:green', animated=True)
+    ax_raster.legend(loc='upper right', fontsize=8)
+    artists = list(raster_lines.values()) + list(psth_lines.values()) + [cum_line]
+    fig.tight_layout()
+
+    state = {'background': None}
+
+    def on_draw(_event):
+        # Full draws (first show, resize, new axis limits) refresh the blit background
+        state['background'] = fig.canvas.copy_from_bbox(fig.bbox)
+        view.dirty = True
+
+    fig.canvas.mpl_connect('draw_event', on_draw)
+    plt.show(block=False)
+    fig.canvas.draw()
+
+    frame_s = 1.0 / FPS
+    while plt.fignum_exists(fig.number):
+        frame_start = time.time()
+        for _ in range(MAX_EVENTS_PER_FRAME):
+            try:
+                view.handle(q.get_nowait())
+            except queue.Empty:
+                break
+        view.tick()
+
+        if view.dirty:
+            view.dirty = False
+            rescale = False
+            for tone in TONES:
+                raster_lines[tone].set_data(*view.raster_points(tone))
+                rate = view.psth(tone)
+                psth_lines[tone].set_ydata(rate)
+                if rate.max(initial=0) > ax_psth.get_ylim()[1]:
+                    ax_psth.set_ylim(0, rate.max() * 1.5)
+                    rescale = True
+            x, y = view.cum_trace()
+            cum_line.set_data(x, y)
+            if len(x) and x[-1] > ax_cum.get_xlim()[1]:
+                ax_cum.set_xlim(1, x[-1] * 2)
+                rescale = True
+            if len(y) and y[-1] > ax_cum.get_ylim()[1]:
+                ax_cum.set_ylim(0, y[-1] * 2)
+                rescale = True
+
+            # Axis limits only change occasionally; otherwise blit the artists
+            if rescale:
+                fig.canvas.draw()
+                view.dirty = False
+            fig.canvas.restore_region(state['background'])
+            for artist in artists:
+                artist.axes.draw_artist(artist)
+            fig.canvas.blit(fig.bbox)
+
+        fig.canvas.flush_events()
+        time.sleep(max(0.0, frame_s - (time.time() - frame_start)))
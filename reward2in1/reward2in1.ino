@@ -11,6 +11,7 @@
 #define TONE_DURATION 1000
 #define POST_TONE_DELAY 1000
 #define MAX_SAME_TONE 5
+#define MAX_BLOCK 32   // max trials per uploaded schedule block
 #define LICK_DEBOUNCE 0.025
 
 // === Reward Probabilities (%)
@@ -33,6 +34,7 @@ const int TONE2_FREQ = 9000;
 // === Serial Bytes
 const byte ARDUINO_RESET = 'r';
 const byte ARDUINO_READY = 'x';
+const byte SCHEDULE_BLOCK = 'S';  // 'S' + tag + one code per trial + '\n'
 
 // === State Variables
 bool started = false;
@@ -76,7 +78,9 @@ void loop() {
   if (Serial.available() > 0) {
     char incoming = Serial.read();
     if (incoming == '1' && started) {
-      run_trial();
+      run_random_trial();
+    } else if (incoming == SCHEDULE_BLOCK) {
+      run_schedule_block();
     } else if (incoming == 't') {
       started = true;
       waiting_for_ttl = false;
@@ -90,9 +94,32 @@ void loop() {
   }
 }
 
-void run_trial() {
-  lick_count_this_trial = 0;
+// Block from Python: one tag byte naming the upload, then one code per trial
+// Schedule codes: '0' + (tone | reward << 1)
+//   bit0: 0 = Tone1_low, 1 = Tone2_high
+//   bit1: 1 = deliver water
+// Each trial is announced as BLOCK_TRIAL,<tag>,<index> so Python can match
+// its result to the schedule even if a result arrives late.
+void run_schedule_block() {
+  byte block[MAX_BLOCK + 1];
+  int n = Serial.readBytesUntil('\n', block, MAX_BLOCK + 1) - 1;
+  Serial.print("BLOCK_LOADED,");
+  Serial.println(n);
+  if (!started || n <= 0) return;
+
+  for (int i = 0; i < n; i++) {
+    if (Serial.peek() == ARDUINO_RESET) break;  // leave 'r' for loop()
+    byte code = block[i + 1] - '0';
+    Serial.print("BLOCK_TRIAL,");
+    Serial.write(block[0]);
+    Serial.print(",");
+    Serial.println(i);
+    run_trial(code & 1, (code & 2) != 0);
+  }
+  Serial.println("BLOCK_DONE");
+}
 
+void run_random_trial() {
   int rand_choice = random(0, 2);
   if (rand_choice == last_tone) {
     same_count++;
@@ -105,6 +132,13 @@ void run_trial() {
   }
   last_tone = rand_choice;
 
+  int prob = (rand_choice == 0) ? REWARD_PROB_PCT : NONREWARD_PROB_PCT;
+  run_trial(rand_choice, random(100) < prob);
+}
+
+void run_trial(int rand_choice, bool deliver) {
+  lick_count_this_trial = 0;
+
   digitalWrite(TRIAL_ON, HIGH);
   delay(rand_choice == 0 ? TTL_TONE1_DURATION : TTL_TONE2_DURATION);
   digitalWrite(TRIAL_ON, LOW);
@@ -121,7 +155,6 @@ void run_trial() {
 
   if (rand_choice == 0) {
     // === Tone1_low: reward-eligible ===
-    bool deliver = (random(100) < REWARD_PROB_PCT);  // 95% yes, 5% no
     if (deliver) {
       give_reward();
       Serial.print("Tone1_low,Reward,LickCount:");
@@ -131,7 +164,6 @@ void run_trial() {
     }
   } else {
     // === Tone2_high: normally non-reward ===
-    bool deliver = (random(100) < NONREWARD_PROB_PCT);  // 20% yes, 80% no
     if (deliver) {
       give_reward();
       Serial.print("Tone2_high,Reward,LickCount:");
@@ -0,0 +1,294 @@
+"""Record or replay the raw serial stream of any host script.
+
+    python serialtap.py record capture.lkcap reward2in1/2in1.py
+    python serialtap.py replay --speed 10 capture.lkcap reward2in1/2in1.py
+
+Options go before the capture path; everything after the script path is
+passed to the script.
+
+The script runs unchanged: serial.Serial is swapped for a tapping or a
+replaying class before the script is started.
+
+Capture format: MAGIC, then records of  kind(1s) t(float64) len(uint32) data
+  O  port opened (data = port name)
+  R  bytes read by the script
+  W  bytes written by the script
+  E  read/in_waiting/write raised (data = exception text), e.g. an unplug
+t is seconds since the capture started.
+
+In replay, an E record, or the end of any session but the last, raises
+serial.SerialException so the script's reconnect path runs; the next open
+serves the next captured session.
+"""
+import argparse
+import atexit
+import os
+import queue
+import runpy
+import struct
+import sys
+import threading
+import time
+import _thread
+
+import serial
+
+MAGIC = b"LKCAP1\n"
+RECORD = struct.Struct("<cdI")
+
+# ==== RECORD ====
+class CaptureWriter:
+    def __init__(self, path):
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC)
+        self.start = time.time()
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def write(self, kind, data):
+        with self.lock:
+            if self.f.closed:
+                return
+            self.f.write(RECORD.pack(kind, time.time() - self.start, len(data)))
+            self.f.write(data)
+            self.f.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+def make_tap_serial(capture):
+    class TapSerial(serial.Serial):
+        def open(self):
+            super().open()
+            capture.write(b'O', str(self.port).encode())
+
+        def _record_error(self, e):
+            capture.write(b'E', f"{type(e).__name__}: {e}".encode(errors='replace'))
+
+        @property
+        def in_waiting(self):
+            try:
+                return super().in_waiting
+            except (serial.SerialException, OSError) as e:
+                self._record_error(e)
+                raise
+
+        def read(self, size=1):
+            try:
+                data = super().read(size)
+            except (serial.SerialException, OSError) as e:
+                self._record_error(e)
+                raise
+            if data:
+                capture.write(b'R', data)
+            return data
+
+        def write(self, data):
+            capture.write(b'W', bytes(data))
+            try:
+                return super().write(data)
+            except (serial.SerialException, OSError) as e:
+                self._record_error(e)
+                raise
+
+    return TapSerial
+
+# ==== REPLAY ====
+def load_capture(path):
+    """Return a list of sessions, one per port open: [(t, kind, data), ...].
+
+    kind is b'R' (bytes read) or b'E' (the link error that ended the session).
+    """
+    sessions = []
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a serial capture")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            kind, t, n = RECORD.unpack(head)
+            data = f.read(n)
+            if kind == b'O':
+                sessions.append((t, []))
+            elif kind in (b'R', b'E') and sessions:
+                sessions[-1][1].append((t - sessions[-1][0], kind, data))
+    return sessions
+
+class ScaledClock:
+    """Make every clock and timeout the script can see run at `speed` x.
+
+    Covers time.time/monotonic/sleep and every Condition.wait timeout, which
+    is what queue.Queue.get, Event.wait and threading.Timer block on. Queue
+    measures its deadlines with the monotonic clock it imported, so that
+    reference is patched too. Event order is then the same at any speed; only
+    OS scheduling jitter (~ms of real time) is magnified by `speed`.
+    """
+
+    def __init__(self, speed):
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.speed = speed
+        self.real_time = time.time
+        self.real_monotonic = time.monotonic
+        self.real_sleep = time.sleep
+        self.real_cond_wait = threading.Condition.wait
+        self.start = self.real_time()
+        self.start_mono = self.real_monotonic()
+
+    def now(self):
+        return self.start + (self.real_time() - self.start) * self.speed
+
+    def monotonic(self):
+        return self.start_mono + (self.real_monotonic() - self.start_mono) * self.speed
+
+    def sleep(self, seconds):
+        self.real_sleep(max(seconds, 0) / self.speed)
+
+    def install(self):
+        clock = self
+
+        def cond_wait(cond, timeout=None):
+            return clock.real_cond_wait(cond, None if timeout is None else max(timeout, 0) / clock.speed)
+
+        time.time = self.now
+        time.monotonic = self.monotonic
+        time.sleep = self.sleep
+        threading.Condition.wait = cond_wait
+        threading._time = self.monotonic  # Condition.wait_for deadlines
+        queue.time = self.monotonic       # Queue.get/put deadlines
+
+def make_replay_serial(sessions, clock):
+    state = {'next': 0}
+    lock = threading.Lock()
+
+    class ReplaySerial:
+        """Serves one captured session; chunk boundaries match the capture."""
+
+        def __init__(self, port=None, baudrate=9600, timeout=None, **kwargs):
+            with lock:
+                idx = state['next']
+                state['next'] += 1
+            if idx >= len(sessions):
+                raise serial.SerialException(f"Replay has no session #{idx + 1} to open")
+            self.chunks = sessions[idx][1]
+            self.session = idx + 1
+            self.last_session = idx == len(sessions) - 1
+            self.port = port
+            self.baudrate = baudrate
+            self.timeout = timeout
+            self.is_open = True
+            self.opened = clock.now()
+            self.pos = 0      # next chunk
+            self.offset = 0   # bytes already served from chunks[pos]
+            self.finished = False
+            self.error = None  # set once the captured link error has been reached
+
+        def _check_link(self):
+            if self.error is None and self.pos < len(self.chunks):
+                t, kind, data = self.chunks[self.pos]
+                if kind == b'E' and clock.now() - self.opened >= t:
+                    self.error = data.decode(errors='replace')
+            if self.error is None and self.pos >= len(self.chunks) and not self.last_session:
+                # Older captures have no E record: the reopen means the link dropped
+                self.error = f"session #{self.session} ended (link dropped)"
+            if self.error is not None:
+                raise serial.SerialException(f"Replayed link error: {self.error}")
+
+        def _ready(self):
+            self._check_link()
+            if self.pos >= len(self.chunks):
+                return 0
+            t, _, data = self.chunks[self.pos]
+            if clock.now() - self.opened < t:
+                return 0
+            return len(data) - self.offset
+
+        def _check_end(self):
+            if self.pos >= len(self.chunks) and not self.finished:
+                self.finished = True
+                print("[⏹] Replay finished.")
+                _thread.interrupt_main()
+
+        @property
+        def in_waiting(self):
+            return self._ready()
+
+        def read(self, size=1):
+            if not self.is_open:
+                raise serial.SerialException("Attempting to use a port that is not open")
+            deadline = None if self.timeout is None else clock.now() + self.timeout
+            while not self._ready():
+                self._check_end()
+                if self.finished or (deadline is not None and clock.now() >= deadline):
+                    if self.finished and deadline is not None:
+                        clock.sleep(deadline - clock.now())
+                    return b""
+                clock.real_sleep(0.0005)
+            _, _, data = self.chunks[self.pos]
+            out = data[self.offset:self.offset + size]
+            self.offset += len(out)
+            if self.offset >= len(data):
+                self.pos += 1
+                self.offset = 0
+            return out
+
+        def readline(self):
+            line = b""
+            while not line.endswith(b"\n"):
+                c = self.read(1)
+                if not c:
+                    break
+                line += c
+            return line
+
+        def write(self, data):
+            if not self.is_open:
+                raise serial.SerialException("Attempting to use a port that is not open")
+            self._check_link()
+            return len(data)
+
+        def reset_input_buffer(self):
+            pass
+
+        def flush(self):
+            pass
+
+        def close(self):
+            self.is_open = False
+
+    return ReplaySerial
+
+# ==== MAIN ====
+def run_script(script, args):
+    sys.argv = [script] + args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    runpy.run_path(script, run_name="__main__")
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay raw serial traffic of a host script.")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("capture", help="capture file (.lkcap)")
+    parser.add_argument("script", help="host script to run, e.g. reward2in1/2in1.py")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor (default 1x)")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER)
+    opts = parser.parse_args()
+    if "--speed" in opts.script_args or any(a.startswith("--speed=") for a in opts.script_args):
+        parser.error("--speed must come before the capture path, e.g. "
+                     "'serialtap.py replay --speed 10 capture.lkcap script.py'")
+
+    if opts.mode == "record":
+        serial.Serial = make_tap_serial(CaptureWriter(opts.capture))
+        print(f"[⏺] Recording serial traffic to {opts.capture}")
+    else:
+        sessions = load_capture(opts.capture)
+        clock = ScaledClock(opts.speed)
+        clock.install()
+        serial.Serial = make_replay_serial(sessions, clock)
+        print(f"[▶] Replaying {opts.capture} ({len(sessions)} session(s)) at {opts.speed:g}x")
+
+    run_script(opts.script, opts.script_args)
+
+if __name__ == "__main__":
+    main()
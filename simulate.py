@@ -0,0 +1,365 @@
+"""Monte Carlo task simulator for protocol tuning.
+
+    python simulate.py reward2in1 --sessions 5000
+    python simulate.py condition_reward --set TRIAL_TIMEOUT=8 POST_TRIAL_DELAY_MAX=5
+    python simulate.py pretrain --set NO_LICK_TIMEOUT=30 LICK_RATE_CUE=0.5
+
+Protocol constants mirror the .ino/.py files of each task (times in seconds).
+Licking is Poisson: a spontaneous rate, a cue-driven rate on engaged trials
+(scaled down by DISCRIMINATION on the non-rewarded tone), and consumption
+bouts after water. Engagement halves every SATIETY_REWARDS rewards.
+
+Sessions are simulated in parallel: each worker steps through trials with
+every per-trial quantity drawn as a NumPy array across its sessions.
+"""
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+PROTOCOLS = {
+    "reward2in1": dict(
+        MAX_RUNTIME_MIN=15, MAX_REWARD_COUNT=300, TRIAL_TIMEOUT=15.0, MAX_SAME_TONE=5,
+        TTL_TONE1_DURATION=0.05, TTL_TONE2_DURATION=0.1, TONE_DURATION=1.0,
+        POST_TONE_DELAY=1.0, PUMP_DURATION=0.15,
+        POST_TRIAL_DELAY_MIN=5.0, POST_TRIAL_DELAY_MAX=8.0,
+        REWARD_PROB_PCT=95, NONREWARD_PROB_PCT=20,
+        BLOCK_SIZE=20,  # host-generated balanced blocks, as in 2in1.py
+        HOST_GAP=0.0,   # block schedules: no host pause between trials
+    ),
+    "condition_reward": dict(
+        MAX_RUNTIME_MIN=30, MAX_REWARD_COUNT=300, TRIAL_TIMEOUT=10.0, MAX_SAME_TONE=5,
+        TTL_TONE1_DURATION=0.05, TTL_TONE2_DURATION=0.1, TONE_DURATION=1.0,
+        POST_TONE_DELAY=1.0, PUMP_DURATION=0.1, FIXED_POST_PUMP_DELAY=2.0,
+        POST_TRIAL_DELAY_MIN=2.0, POST_TRIAL_DELAY_MAX=4.0,
+        REWARD_PROB_PCT=100, NONREWARD_PROB_PCT=0,
+        HOST_GAP=0.5,  # time.sleep(0.5) before the next '1'
+    ),
+    "reach": dict(
+        MAX_RUNTIME_MIN=30,  # reachwater.py itself runs until Ctrl+C
+        PRE_TONE_SILENCE=1.0, TONE_DURATION=0.2,
+        RESPONSE_WINDOW=7.0, FLEX_POST_LICK=1.0,
+        TRIAL_INTERVAL_MIN=1.0, TRIAL_INTERVAL_MAX=3.0,
+    ),
+    "pretrain": dict(
+        MAX_RUNTIME_MIN=10, MAX_PUMP_COUNT=300, CALM_DOWN_MS=1500,
+        NO_LICK_TIMEOUT=60, PUMP_DURATION=0.15,
+    ),
+}
+
+MAX_BLOCK = 32  # same as MAX_BLOCK in reward2in1.ino
+
+ANIMAL = dict(
+    LICK_RATE_BASE=0.2,      # spontaneous licks/s
+    LICK_RATE_CUE=3.0,       # extra licks/s after a rewarded cue, engaged trials
+    LICK_RATE_CONSUME=6.0,   # licks/s while drinking
+    CONSUME_BOUT_S=2.0,      # mean drinking bout after water
+    DISCRIMINATION=0.6,      # 0 = same cue response to both tones, 1 = none to Tone2
+    P_ENGAGED=0.9,           # engaged-trial probability at session start
+    SATIETY_REWARDS=200,     # engagement halves every this many rewards
+)
+
+# ==== LICK MODEL ====
+def engaged(rng, p, rewards):
+    return rng.random(rewards.shape) < p["P_ENGAGED"] * 0.5 ** (rewards / p["SATIETY_REWARDS"])
+
+def silence_wait(rng, gap, rate):
+    """Time until the first lick-free interval of `gap` s (Poisson licks).
+
+    The number of shorter intervals is geometric; their summed length uses a
+    normal approximation of the truncated-exponential sum.
+    """
+    rate = np.asarray(rate, dtype=float)
+    wait = np.full(rate.shape, float(gap))
+    r = np.maximum(rate, 1e-9)
+    p_gap = np.exp(-r * gap)
+    n_short = rng.geometric(np.clip(p_gap, 1e-12, 1.0)) - 1
+    q = np.maximum(1 - p_gap, 1e-12)
+    mean = 1 / r - gap * p_gap / q
+    second = (2 / r**2 - p_gap * (gap**2 + 2 * gap / r + 2 / r**2)) / q
+    var = np.maximum(second - mean**2, 0)
+    extra = n_short * mean + np.sqrt(n_short * var) * rng.standard_normal(rate.shape)
+    return wait + np.clip(extra, 0, None)
+
+def pick_tones(rng, last_tone, same_count, max_same):
+    # Same rule as run_trial() in the firmware
+    choice = rng.integers(0, 2, last_tone.shape)
+    repeat = choice == last_tone
+    same_count = np.where(repeat, same_count + 1, 1)
+    forced = repeat & (same_count >= max_same)
+    choice = np.where(forced, 1 - last_tone, choice)
+    same_count = np.where(forced, 0, same_count)
+    return choice, same_count
+
+def run_lengths(tones, last_tone, run):
+    """Longest same-tone run in each row, continuing from (last_tone, run)."""
+    longest = np.zeros(len(tones), int)
+    for col in tones.T:
+        run = np.where(col == last_tone, run + 1, 1)
+        last_tone = col
+        longest = np.maximum(longest, run)
+    return longest, last_tone, run
+
+def schedule_blocks(rng, p, last_tone, run, carry):
+    """One block per session, built like schedule_blocks() in 2in1.py.
+
+    Equal tone counts, fewer than MAX_SAME_TONE in a row across block
+    boundaries, and a fixed reward count per tone with the fractional part
+    (in hundredths) carried into the next block.
+    """
+    n, size = len(last_tone), int(p["BLOCK_SIZE"])
+    tones = rng.permuted(np.tile(np.arange(size) % 2, (n, 1)), axis=1)
+    redo = run_lengths(tones, last_tone, run)[0] >= p["MAX_SAME_TONE"]
+    while redo.any():
+        tones[redo] = rng.permuted(tones[redo], axis=1)
+        redo[redo] = run_lengths(tones[redo], last_tone[redo], run[redo])[0] >= p["MAX_SAME_TONE"]
+    _, last_tone, run = run_lengths(tones, last_tone, run)
+
+    rewards = np.zeros((n, size), bool)
+    keys = rng.random((n, size))
+    for tone, pct in ((0, p["REWARD_PROB_PCT"]), (1, p["NONREWARD_PROB_PCT"])):
+        n_reward, carry[tone] = np.divmod(size // 2 * int(pct) + carry[tone], 100)
+        # rank this tone's trials by a random key; the first n_reward get water
+        k = np.where(tones == tone, keys, np.inf)
+        rank = np.argsort(np.argsort(k, axis=1), axis=1)
+        rewards |= (tones == tone) & (rank < n_reward[:, None])
+    return tones, rewards, last_tone, run, carry
+
+def welch_p(a_sum, a_sq, a_n, b_sum, b_sq, b_n):
+    """Two-sided Welch test, normal approximation, from running sums."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a_mean, b_mean = a_sum / a_n, b_sum / b_n
+        a_var = (a_sq - a_n * a_mean**2) / (a_n - 1)
+        b_var = (b_sq - b_n * b_mean**2) / (b_n - 1)
+        t = (a_mean - b_mean) / np.sqrt(a_var / a_n + b_var / b_n)
+    t = np.nan_to_num(t, nan=0.0, posinf=1e9, neginf=-1e9)
+    return np.array([math.erfc(abs(x) / math.sqrt(2)) for x in t])
+
+# ==== PROTOCOLS ====
+def sim_tone_task(p, n, rng, condition):
+    """reward2in1 and condition_reward: two tones, result line per trial."""
+    runtime = p["MAX_RUNTIME_MIN"] * 60
+    t = np.zeros(n)
+    active = np.ones(n, bool)
+    trials = np.zeros(n, int)
+    rewards = np.zeros(n, int)
+    timeouts = np.zeros(n, int)
+    last_tone = np.full(n, -1)
+    same_count = np.zeros(n, int)
+    prev_iti = np.zeros(n)
+    sums = {k: np.zeros(n) for k in ("r_sum", "r_sq", "r_n", "n_sum", "n_sq", "n_n")}
+    blocks = "BLOCK_SIZE" in p  # reward2in1: host schedule instead of firmware draws
+    carry = {0: np.zeros(n, int), 1: np.zeros(n, int)}
+    trial_in_block = 0
+
+    while active.any():
+        if blocks:
+            if trial_in_block % int(p["BLOCK_SIZE"]) == 0:
+                block_tones, block_rewards, last_tone, same_count, carry = schedule_blocks(
+                    rng, p, last_tone, same_count, carry)
+            col = trial_in_block % int(p["BLOCK_SIZE"])
+            tone, reward = block_tones[:, col], block_rewards[:, col]
+            trial_in_block += 1
+        else:
+            tone, same_count = pick_tones(rng, last_tone, same_count, p["MAX_SAME_TONE"])
+            last_tone = tone
+            pct = np.where(tone == 0, p["REWARD_PROB_PCT"], p["NONREWARD_PROB_PCT"])
+            reward = rng.random(n) * 100 < pct
+        eng = engaged(rng, p, rewards)
+
+        ttl = np.where(tone == 0, p["TTL_TONE1_DURATION"], p["TTL_TONE2_DURATION"])
+        cue_window = p["TONE_DURATION"] + p["POST_TONE_DELAY"]
+        cue_rate = p["LICK_RATE_BASE"] + eng * p["LICK_RATE_CUE"] * np.where(tone == 0, 1.0, 1 - p["DISCRIMINATION"])
+        licks = rng.poisson(cue_rate * cue_window)
+
+        if condition:
+            # water on Tone1 only, licks keep counting through the post-pump delay
+            drink = p["PUMP_DURATION"] + p["FIXED_POST_PUMP_DELAY"]
+            drink_rate = np.where(eng, p["LICK_RATE_CONSUME"], p["LICK_RATE_BASE"])
+            licks = licks + np.where(reward, rng.poisson(drink_rate * drink), 0)
+            to_result = ttl + cue_window + np.where(reward, drink, 0)
+        else:
+            to_result = ttl + cue_window + p["PUMP_DURATION"]
+
+        iti = rng.uniform(p["POST_TRIAL_DELAY_MIN"], p["POST_TRIAL_DELAY_MAX"], n)
+        # The board is still in the previous ITI when the host starts waiting
+        wait = np.maximum(prev_iti - p["HOST_GAP"], 0) + to_result
+        timed_out = wait > p["TRIAL_TIMEOUT"]
+        prev_iti = iti
+
+        step = active.astype(int)
+        t += active * (wait + p["HOST_GAP"])
+        trials += step
+        timeouts += step * timed_out
+        logged = active & ~timed_out
+        rewards += active * reward
+        key = np.where(reward, "r", "n")
+        for k in ("r", "n"):
+            m = logged & (key == k)
+            sums[k + "_sum"] += m * licks
+            sums[k + "_sq"] += m * licks**2
+            sums[k + "_n"] += m
+
+        active &= (t < runtime) & (rewards < p["MAX_REWARD_COUNT"])
+
+    pvalue = welch_p(sums["r_sum"], sums["r_sq"], sums["r_n"], sums["n_sum"], sums["n_sq"], sums["n_n"])
+    return dict(trials=trials, duration_s=t, rewards=rewards, timeouts=timeouts, pvalue=pvalue)
+
+def sim_reward2in1(p, n, rng):
+    return sim_tone_task(p, n, rng, condition=False)
+
+def sim_condition_reward(p, n, rng):
+    return sim_tone_task(p, n, rng, condition=True)
+
+def sim_reach(p, n, rng):
+    runtime = p["MAX_RUNTIME_MIN"] * 60
+    t = np.zeros(n)
+    active = np.ones(n, bool)
+    trials = np.zeros(n, int)
+    reaches = np.zeros(n, int)
+    while active.any():
+        eng = engaged(rng, p, trials)  # water on every trial
+        dur = silence_wait(rng, p["PRE_TONE_SILENCE"], np.full(n, p["LICK_RATE_BASE"]))
+        dur += p["TONE_DURATION"] + 0.1 + 0.1 + p["RESPONSE_WINDOW"]
+        rate = p["LICK_RATE_BASE"] + eng * p["LICK_RATE_CUE"]
+        reached = rng.random(n) < 1 - np.exp(-rate * p["RESPONSE_WINDOW"])
+        drink = np.where(eng, rng.exponential(p["CONSUME_BOUT_S"], n), 0)
+        post = drink + silence_wait(rng, p["FLEX_POST_LICK"], np.full(n, p["LICK_RATE_BASE"]))
+        dur += np.where(reached, post, 0)
+        dur += rng.uniform(p["TRIAL_INTERVAL_MIN"], p["TRIAL_INTERVAL_MAX"], n)
+
+        t += active * dur
+        trials += active
+        reaches += active & reached
+        active &= t < runtime
+    return dict(trials=trials, duration_s=t, rewards=trials.copy(), reaches=reaches)
+
+def sim_pretrain(p, n, rng):
+    """One step per main-loop iteration of pretrain.py.
+
+    A trial waits for the first lick; meanwhile the watchdog auto-pumps every
+    NO_LICK_TIMEOUT, counted from the last lick (about a calm-down before the
+    wait starts). The lick then gets a TRIAL pump and a calm-down. If an auto
+    pump fired, the next iteration skips the lick wait and only calms down.
+    """
+    runtime = p["MAX_RUNTIME_MIN"] * 60
+    timeout = p["NO_LICK_TIMEOUT"]
+    calm_s = p["CALM_DOWN_MS"] / 1000
+    t = np.zeros(n)
+    active = np.ones(n, bool)
+    skip = np.zeros(n, bool)
+    trials = np.zeros(n, int)
+    pumps = np.zeros(n, int)
+    auto = np.zeros(n, int)
+    while active.any():
+        eng = engaged(rng, p, pumps)
+        rate = p["LICK_RATE_BASE"] + eng * p["LICK_RATE_CUE"]
+        first_lick = rng.exponential(1 / rate)
+        first_deadline = max(timeout - calm_s, 0)
+        n_auto = np.where(first_lick < first_deadline, 0,
+                          1 + (first_lick - first_deadline) // timeout).astype(int)
+        n_auto = np.where(skip, 0, n_auto)
+        drink = np.where(eng, rng.exponential(p["CONSUME_BOUT_S"], n), 0)
+        silence = silence_wait(rng, calm_s, np.full(n, p["LICK_RATE_BASE"]))
+        dur = np.where(skip, silence, first_lick + p["PUMP_DURATION"] + drink + silence)
+
+        t += active * dur
+        trials += active
+        pumps += active * (~skip + n_auto)
+        auto += active * n_auto
+        skip = n_auto > 0
+        active &= (t < runtime) & (pumps < p["MAX_PUMP_COUNT"])
+    return dict(trials=trials, duration_s=t, rewards=pumps, auto_pumps=auto)
+
+SIMULATORS = {
+    "reward2in1": sim_reward2in1,
+    "condition_reward": sim_condition_reward,
+    "reach": sim_reach,
+    "pretrain": sim_pretrain,
+}
+
+# ==== RUN ====
+def run_chunk(protocol, params, n, seed_seq):
+    return SIMULATORS[protocol](params, n, np.random.default_rng(seed_seq))
+
+def simulate(protocol, params, sessions, seed=None, workers=None):
+    workers = workers or os.cpu_count() or 1
+    sizes = [len(c) for c in np.array_split(np.arange(sessions), workers) if len(c)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    with ProcessPoolExecutor(max_workers=len(sizes)) as pool:
+        parts = list(pool.map(run_chunk, [protocol] * len(sizes), [params] * len(sizes), sizes, seeds))
+    return {k: np.concatenate([part[k] for part in parts]) for k in parts[0]}
+
+def report(protocol, params, results, alpha):
+    def line(name, x):
+        lo, hi = np.percentile(x, [5, 95])
+        print(f"  {name:<18} {np.mean(x):8.1f} ± {np.std(x):6.1f}   [5-95%: {lo:.1f}-{hi:.1f}]")
+
+    hours = results["duration_s"] / 3600
+    print(f"\n=== {protocol}: {len(hours)} simulated sessions ===")
+    line("Trials/hour", results["trials"] / hours)
+    line("Trials", results["trials"])
+    line("Rewards", results["rewards"])
+    line("Session min", results["duration_s"] / 60)
+    for key in ("timeouts", "reaches", "auto_pumps"):
+        if key in results:
+            line(key.replace("_", " ").capitalize(), results[key])
+    cap = params.get("MAX_REWARD_COUNT", params.get("MAX_PUMP_COUNT"))
+    if cap is not None:
+        print(f"  Hit reward cap     {np.mean(results['rewards'] >= cap):8.1%}")
+    if "pvalue" in results:
+        print(f"  Power (a={alpha:g})     {np.mean(results['pvalue'] < alpha):8.1%}"
+              "   reward vs no-reward licks, Welch test per session")
+
+def parse_overrides(items):
+    overrides = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        overrides[key.strip().upper()] = float(value)
+    return overrides
+
+def check_params(params):
+    """Same limits as check_schedule_config() in 2in1.py, for --set overrides."""
+    problems = []
+    if "MAX_SAME_TONE" in params and params["MAX_SAME_TONE"] < 2:
+        problems.append(f"MAX_SAME_TONE must be at least 2, got {params['MAX_SAME_TONE']:g}")
+    if "BLOCK_SIZE" in params:
+        size = params["BLOCK_SIZE"]
+        if size != int(size) or size <= 0 or size % 2 or size > MAX_BLOCK:
+            problems.append(f"BLOCK_SIZE must be even and between 2 and {MAX_BLOCK}, got {size:g}")
+    for name in ("REWARD_PROB_PCT", "NONREWARD_PROB_PCT"):
+        if name in params and not (params[name] == int(params[name]) and 0 <= params[name] <= 100):
+            problems.append(f"{name} must be a whole percentage 0-100, got {params[name]:g}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo simulator for lick task protocols.")
+    parser.add_argument("protocol", choices=sorted(SIMULATORS))
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="override protocol or animal parameters")
+    opts = parser.parse_args()
+
+    params = {**PROTOCOLS[opts.protocol], **ANIMAL}
+    overrides = parse_overrides(opts.set)
+    unknown = set(overrides) - set(params)
+    if unknown:
+        parser.error(f"unknown parameter(s): {', '.join(sorted(unknown))}")
+    params.update(overrides)
+    problems = check_params(params)
+    if problems:
+        parser.error("; ".join(problems))
+
+    print("Parameters:")
+    for key, value in params.items():
+        print(f"  {key} = {value:g}")
+    results = simulate(opts.protocol, params, opts.sessions, opts.seed, opts.workers)
+    report(opts.protocol, params, results, opts.alpha)
+
+if __name__ == "__main__":
+    main()